@@ -4,4 +4,12 @@
 
 from .__version__ import __author__, __email__, __version__  # noqa: F401
 
-from .wsgi import application  # noqa: F401
+# Importing wsgi loads the configuration, the application itself is created lazily
+from . import wsgi  # noqa: F401
+
+
+def __getattr__(name):
+    # `finch.application` is created on first access, see `finch.wsgi`
+    if name == "application":
+        return wsgi.application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -47,11 +47,11 @@ PCIC_12_MODELS_REALIZATIONS = [
 ALL_24_MODELS = "24MODELS"
 PCIC_12 = "PCIC12"
 
-ALLOWED_MODEL_NAMES = [ALL_24_MODELS, PCIC_12] + BCCAQV2_MODELS
+ALLOWED_MODEL_NAMES = (ALL_24_MODELS, PCIC_12, *BCCAQV2_MODELS)
 
-# a list of all posible netcdf arguments in xclim
+# all posible netcdf arguments in xclim, frozen as it is shared by every process module
 # Read in the list of variables from xclim directly and add some other less documented.
-xclim_netcdf_variables = set(VARIABLES.keys()).union(
+xclim_netcdf_variables = frozenset(VARIABLES.keys()).union(
     {
         "per",
         "q",
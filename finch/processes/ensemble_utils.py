@@ -1,12 +1,14 @@
 from collections import deque
-from copy import deepcopy
 from dataclasses import dataclass
 from enum import Enum
+from functools import lru_cache
+import os
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, cast
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Pattern, Tuple, cast
 import warnings
 
-from parse import parse
+import numpy as np
 from pywps import ComplexInput, FORMATS, Process
 from pywps import configuration
 from pywps.app.exceptions import ProcessError
@@ -28,11 +30,13 @@ from .subset import finch_subset_bbox, finch_subset_gridpoint, finch_subset_shap
 from .utils import (
     PywpsInput,
     RequestInputs,
+    chunk_dataset,
     compute_indices,
     dataset_to_dataframe,
     dataset_to_netcdf,
     format_metadata,
     log_file_path,
+    process_threaded,
     single_input_or_none,
     write_log,
     zip_files,
@@ -40,7 +44,36 @@ from .utils import (
 from .wps_base import make_nc_input
 
 
-@dataclass
+def _compile_filename_pattern(template: str) -> Pattern:
+    """Compile a filename template like "{variable}_{frequency}.nc" to a regular expression.
+
+    Like the `parse` library: the fields match any non-empty text, are non-greedy,
+    and the matching is case insensitive.
+    """
+    parts = re.split(r"\{(\w+)\}", template)
+    # the field names are at odd indices
+    regex = "".join(
+        f"(?P<{part}>.+?)" if n % 2 else re.escape(part) for n, part in enumerate(parts)
+    )
+    return re.compile(regex, re.IGNORECASE | re.DOTALL)
+
+
+_bccaqv2_filename_pattern = _compile_filename_pattern(
+    "_".join(
+        [
+            "{variable}",
+            "{frequency}",
+            "BCCAQv2+ANUSPLIN300",
+            "{driving_model_id}",
+            "{driving_experiment_id}",
+            "r{driving_realization}i{driving_initialization_method}p{driving_physics_version}",
+            "{date_start}-{date_end}.nc",
+        ]
+    )
+)
+
+
+@dataclass(frozen=True)
 class Bccaqv2File:
     variable: str
     frequency: str
@@ -53,28 +86,33 @@ class Bccaqv2File:
     date_end: Optional[str] = None
 
     @classmethod
+    @lru_cache(maxsize=4096)
     def from_filename(cls, filename):
-        pattern = "_".join(
-            [
-                "{variable}",
-                "{frequency}",
-                "BCCAQv2+ANUSPLIN300",
-                "{driving_model_id}",
-                "{driving_experiment_id}",
-                "r{driving_realization}i{driving_initialization_method}p{driving_physics_version}",
-                "{date_start}-{date_end}.nc",
-            ]
-        )
-        try:
-            return cls(**parse(pattern, filename).named)
-        except AttributeError:
-            return
+        # the same filenames are parsed for each rcp and variable
+        match = _bccaqv2_filename_pattern.fullmatch(filename)
+        if match is not None:
+            return cls(**match.groupdict())
+
+
+def _mean_of_two(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Element-wise mean of two arrays, using a single temporary array."""
+    mean = np.add(a, b, dtype=np.result_type(a, b, np.float32))
+    mean *= 0.5
+    return mean
 
 
 def _tas(tasmin: xr.Dataset, tasmax: xr.Dataset) -> xr.Dataset:
     """Compute daily mean temperature, and set attributes in the output Dataset."""
 
-    tas = (tasmin["tasmin"] + tasmax["tasmax"]) / 2
+    tas = xr.apply_ufunc(
+        _mean_of_two,
+        tasmin["tasmin"],
+        tasmax["tasmax"],
+        # like `tasmin + tasmax`, only keep the common time steps
+        join="inner",
+        dask="parallelized",
+        output_dtypes=[np.result_type(tasmin["tasmin"].dtype, tasmax["tasmax"].dtype, np.float32)],
+    )
     tas_ds = tas.to_dataset(name="tas")
     tas_ds.attrs = tasmin.attrs
     tas_ds["tas"].attrs = tasmin["tasmin"].attrs
@@ -83,36 +121,39 @@ def _tas(tasmin: xr.Dataset, tasmax: xr.Dataset) -> xr.Dataset:
     return tas_ds
 
 
-def _percentile_doy_tn10(tasmin: xr.Dataset):
-    return percentile_doy(tasmin.tasmin, per=10).sel(percentiles=10, drop=True).to_dataset(name="tn10")
-
-
-def _percentile_doy_tn90(tasmin: xr.Dataset):
-    return percentile_doy(tasmin.tasmin, per=90).sel(percentiles=90, drop=True).to_dataset(name="tn90")
-
-
-def _percentile_doy_tx90(tasmax: xr.Dataset):
-    return percentile_doy(tasmax.tasmax, per=90).sel(percentiles=90, drop=True).to_dataset(name="tx90")
-
-
-def _percentile_doy_t10(tas: xr.Dataset):
-    return percentile_doy(tas.tas, per=10).sel(percentiles=10, drop=True).to_dataset(name="t10")
-
+def _percentile_doy(source: xr.DataArray, percentiles: Dict[str, int]) -> xr.Dataset:
+    """Compute day of year percentiles, and return them as variables of an output Dataset.
 
-def _percentile_doy_t90(tas: xr.Dataset):
-    return percentile_doy(tas.tas, per=90).sel(percentiles=90, drop=True).to_dataset(name="t90")
+    `percentiles` maps the output variable names to their percentile value (ex: {"tn10": 10}),
+    so that all the percentiles of the same source variable are computed in a single pass.
+    """
+    # percentile_doy rechunks along time, make the time dimension contiguous beforehand
+    chunks = {d: -1 if d == "time" else "auto" for d in source.dims}
+    per = percentile_doy(source.chunk(chunks), per=list(percentiles.values()))
+    return xr.Dataset(
+        {name: per.sel(percentiles=value, drop=True) for name, value in percentiles.items()}
+    )
 
 
 variable_computations = {
     "tas": {"inputs": ["tasmin", "tasmax"], "function": _tas},
-    "tn10": {"inputs": ["tasmin"], "function": _percentile_doy_tn10},
-    "tn90": {"inputs": ["tasmin"], "function": _percentile_doy_tn90},
-    "tx90": {"inputs": ["tasmax"], "function": _percentile_doy_tx90},
-    "t10": {"inputs": ["tas"], "function": _percentile_doy_t10},
-    "t90": {"inputs": ["tas"], "function": _percentile_doy_t90},
+    "tn10": {"inputs": ["tasmin"], "percentile": 10},
+    "tn90": {"inputs": ["tasmin"], "percentile": 90},
+    "tx90": {"inputs": ["tasmax"], "percentile": 90},
+    "t10": {"inputs": ["tas"], "percentile": 10},
+    "t90": {"inputs": ["tas"], "percentile": 90},
 }
 
 accepted_variables = bccaq_variables.union(variable_computations)
+# filenames starting with accepted variable names, joined by '+' when a file
+# contains multiple variables (ex: tasmin_... or tn10+tn90_...)
+# longest names first, so that ex: 'tasmin' is tried before 'tas'
+_variable_names_pattern = "|".join(
+    re.escape(v) for v in sorted(accepted_variables, key=len, reverse=True)
+)
+_variable_filename_pattern = re.compile(
+    r"^((?:{0})(?:\+(?:{0}))*)_(.*)$".format(_variable_names_pattern)
+)
 not_implemented_variables = xclim_netcdf_variables - accepted_variables
 
 
@@ -135,13 +176,17 @@ def get_bccaqv2_local_files_datasets(
     models=None,
 ) -> List[str]:
     """Get a list of filenames corresponding to variable and rcp on a local filesystem."""
+    models = tuple(models) if models is not None else None
 
     urls = []
-    for file in Path(catalog_url).glob("*.nc"):
-        if _bccaqv2_filter(
-            method, file.name, str(file), variables=variables, rcp=rcp, models=models
-        ):
-            urls.append(str(file))
+    with os.scandir(catalog_url) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".nc") or not entry.is_file():
+                continue
+            if _bccaqv2_filter(
+                method, entry.name, entry.path, variables=variables, rcp=rcp, models=models
+            ):
+                urls.append(entry.path)
     return urls
 
 
@@ -160,20 +205,30 @@ def get_bccaqv2_opendap_datasets(
     For more general use cases, see the `xarray` and `requests` methods below."""
 
     catalog = TDSCatalog(catalog_url)
+    models = tuple(models) if models is not None else None
 
-    urls = []
-    for dataset in catalog.datasets.values():
-        opendap_url = dataset.access_urls["OPENDAP"]
-        if _bccaqv2_filter(
-            method,
-            dataset.name,
-            opendap_url,
-            variables=variables,
-            rcp=rcp,
-            models=models,
-        ):
-            urls.append(opendap_url)
-    return urls
+    datasets = [(d.name, d.access_urls["OPENDAP"]) for d in catalog.datasets.values()]
+
+    return [
+        opendap_url
+        for name, opendap_url in datasets
+        if _bccaqv2_filter(method, name, opendap_url, variables=variables, rcp=rcp, models=models)
+    ]
+
+
+@lru_cache(maxsize=128)
+def _bccaqv2_allowed_models(models: Optional[Tuple[str, ...]]) -> FrozenSet[Tuple[str, str]]:
+    """Returns the (lowercase model name, realization number) pairs to keep."""
+    if models is None or [m.lower() for m in models] == [ALL_24_MODELS.lower()]:
+        models = BCCAQV2_MODELS
+
+    if [m.lower() for m in models] == [PCIC_12.lower()]:
+        return frozenset(
+            (model.lower(), realization[1:])
+            for model, realization in PCIC_12_MODELS_REALIZATIONS
+        )
+
+    return frozenset((m.lower(), "1") for m in models)
 
 
 def _bccaqv2_filter(
@@ -186,10 +241,7 @@ def _bccaqv2_filter(
 ):
     """Parse metadata and filter BCCAQV2 datasets"""
 
-    if models is None or [m.lower() for m in models] == [ALL_24_MODELS.lower()]:
-        models = BCCAQV2_MODELS
-
-    models = [m.lower() for m in models]
+    allowed_models = _bccaqv2_allowed_models(tuple(models) if models is not None else None)
 
     if method == ParsingMethod.filename:
         parsed = Bccaqv2File.from_filename(filename)
@@ -201,17 +253,8 @@ def _bccaqv2_filter(
         if rcp and rcp not in parsed.driving_experiment_id:
             return False
 
-        if models == [PCIC_12.lower()]:
-            for model, realization in PCIC_12_MODELS_REALIZATIONS:
-                model_ok = model.lower() == parsed.driving_model_id.lower()
-                r_ok = realization[1:] == parsed.driving_realization
-                if model_ok and r_ok:
-                    return True
-            return False
-
-        model_ok = parsed.driving_model_id.lower() in models
-        r_ok = parsed.driving_realization == "1"
-        return model_ok and r_ok
+        model = parsed.driving_model_id.lower(), parsed.driving_realization
+        return model in allowed_models
 
     elif method == ParsingMethod.opendap_das:
 
@@ -308,10 +351,8 @@ def _formatted_coordinate(value) -> Optional[str]:
     """
     if not value:
         return
-    try:
+    if isinstance(value, str):
         value = value.split(",")[0]
-    except AttributeError:
-        pass
     return f"{float(value):.3f}"
 
 
@@ -331,16 +372,14 @@ def make_output_filename(process: Process, inputs: List[PywpsInput], rcp=None):
 
     output_parts = [process.identifier]
 
+    # the coordinates are already formatted
     if lat and lon:
-        output_parts.append(f"{float(lat):.3f}")
-        output_parts.append(f"{float(lon):.3f}")
+        output_parts += [lat, lon]
     elif lat0 and lon0:
-        output_parts.append(f"{float(lat0):.3f}")
-        output_parts.append(f"{float(lon0):.3f}")
+        output_parts += [lat0, lon0]
 
     if lat1 and lon1:
-        output_parts.append(f"{float(lat1):.3f}")
-        output_parts.append(f"{float(lon1):.3f}")
+        output_parts += [lat1, lon1]
 
     if rcp:
         output_parts.append(rcp)
@@ -356,7 +395,11 @@ def uses_accepted_netcdf_variables(indicator: Indicator) -> bool:
 def make_indicator_inputs(
     indicator: Indicator, wps_inputs: RequestInputs, files_list: List[Path]
 ) -> List[RequestInputs]:
-    """From a list of files, make a list of inputs used to call the given xclim indicator."""
+    """From a list of files, make a list of inputs used to call the given xclim indicator.
+
+    Only the netcdf inputs differ between each item of the list, all other inputs
+    are shared. They should not be modified in place.
+    """
 
     arguments = set(indicator.parameters)
 
@@ -364,52 +407,49 @@ def make_indicator_inputs(
 
     input_list = []
 
+    def _make_input(variable_name, path):
+        nc_input = make_nc_input(variable_name)
+        nc_input.file = str(path)
+        return deque([nc_input])
+
     if len(required_netcdf_args) == 1:
         variable_name = list(required_netcdf_args)[0]
         for path in files_list:
-            inputs = deepcopy(wps_inputs)
-            inputs[variable_name] = deque([make_nc_input(variable_name)])
-            inputs[variable_name][0].file = str(path)
+            inputs = dict(wps_inputs)
+            inputs[variable_name] = _make_input(variable_name, path)
             input_list.append(inputs)
     else:
         for group in make_file_groups(files_list):
-            inputs = deepcopy(wps_inputs)
+            inputs = dict(wps_inputs)
             for variable_name, path in group.items():
                 if variable_name not in required_netcdf_args:
                     continue
-                inputs[variable_name] = deque([make_nc_input(variable_name)])
-                inputs[variable_name][0].file = str(path)
+                inputs[variable_name] = _make_input(variable_name, path)
             input_list.append(inputs)
 
     return input_list
 
 
 def make_file_groups(files_list: List[Path]) -> List[Dict[str, Path]]:
-    """Groups files by filenames, changing only the netcdf variable name."""
-    groups = []
-    filenames = {f.name: f for f in files_list}
+    """Groups files by filenames, changing only the netcdf variable name.
+
+    A file containing multiple variables is added to its group once for each variable.
+    """
+    groups: Dict[str, Dict[str, Path]] = {}
 
     for file in files_list:
-        if file.name not in filenames:
+        match = _variable_filename_pattern.match(file.name)
+        if match is None:
             continue
-        group = {}
-        for variable in accepted_variables:
-            if file.name.startswith(f"{variable}_"):
-                for other_var in accepted_variables.difference([variable]):
-                    other_filename = file.name.replace(variable, other_var, 1)
-                    if other_filename in filenames:
-                        group[other_var] = filenames[other_filename]
-                        del filenames[other_filename]
+        variables, rest = match.groups()
+        group = groups.setdefault(rest, {})
+        for variable in variables.split("+"):
+            group[variable] = file
 
-                group[variable] = file
-                del filenames[file.name]
-                groups.append(group)
-                break
+    return list(groups.values())
 
-    return groups
 
-
-def make_ensemble(files: List[Path], percentiles: List[int]) -> None:
+def make_ensemble(files: List[Path], percentiles: List[int]) -> xr.Dataset:
     ensemble = ensembles.create_ensemble(files)
     # make sure we have data starting in 1950
     ensemble = ensemble.sel(time=(ensemble.time.dt.year >= 1950))
@@ -420,6 +460,14 @@ def make_ensemble(files: List[Path], percentiles: List[int]) -> None:
         if ensemble[v].attrs.get('is_dayofyear', 0) == 1:
             ensemble[v] = doy_to_days_since(ensemble[v])
 
+    # Percentiles are computed along the realization dimension, which must be in a single chunk.
+    # Tile the other dimensions so that dask can compute the percentiles of each tile in parallel.
+    chunks = chunk_dataset(
+        ensemble, max_size=1000000, chunk_dims=[d for d in ensemble.dims if d != "realization"]
+    )
+    chunks["realization"] = -1
+    ensemble = ensemble.chunk(chunks)
+
     ensemble_percentiles = ensembles.ensemble_percentiles(ensemble, values=percentiles)
 
     # Doy data converted previously is converted back.
@@ -438,6 +486,7 @@ def make_ensemble(files: List[Path], percentiles: List[int]) -> None:
     # a best effort at working around what looks like a bug in either xclim or xarray.
     # The xarray documentation mentions: 'this method can be necessary when working
     # with many file objects on disk.'
+    # Only the percentiles are loaded in memory: the ensemble is read chunk by chunk.
     ensemble_percentiles.load()
 
     return ensemble_percentiles
@@ -455,11 +504,11 @@ def compute_intermediate_variables(
     for group in file_groups:
         # add file paths that are required without any computation
         for variable, path in group.items():
-            if variable in required_variable_names:
+            if variable in required_variable_names and path not in output_files_list:
                 output_files_list.append(path)
 
         first_variable = list(group)[0]
-        output_basename = group[first_variable].name.split("_", 1)[1]
+        output_basename = _variable_filename_pattern.match(group[first_variable].name).group(2)
 
         # compute other required variables
         variables_to_compute = set(required_variable_names) - set(group)
@@ -470,44 +519,103 @@ def compute_intermediate_variables(
                 if input_name in variable_computations:
                     variables_to_compute.add(input_name)
 
+        # Intermediate variables are kept lazily in memory, so that dask can chain
+        # the computations (ex: tas -> t10). Only the required variables are written,
+        # all together in a single file (ex: tn10+tn90_...).
+        datasets: Dict[str, xr.Dataset] = {}
+        computed_required = []
+
+        def _get_dataset(name):
+            if name not in datasets:
+                datasets[name] = xr.open_dataset(group[name], chunks={"time": -1})
+            return datasets[name]
+
         while variables_to_compute:
             for variable in list(variables_to_compute):
                 input_names = variable_computations[variable]["inputs"]
-                if all(i in group for i in input_names):
-                    inputs = [xr.open_dataset(group[name]) for name in input_names]
-
-                    output = variable_computations[variable]["function"](*inputs)
-                    output_file = Path(workdir) / f"{variable}_{output_basename}"
-                    dataset_to_netcdf(output, output_file)
-
-                    variables_to_compute.remove(variable)
-                    group[variable] = output_file
-                    if variable in required_variable_names:
-                        output_files_list.append(output_file)
+                if all(i in group or i in datasets for i in input_names):
+                    inputs = [_get_dataset(name) for name in input_names]
+
+                    if "percentile" in variable_computations[variable]:
+                        # compute every percentile of this input at once (ex: tn10 and tn90)
+                        percentiles = {
+                            v: variable_computations[v]["percentile"]
+                            for v in variables_to_compute
+                            if variable_computations[v]["inputs"] == input_names
+                            and "percentile" in variable_computations[v]
+                        }
+                        source = inputs[0][input_names[0]]
+                        output = _percentile_doy(source, percentiles)
+                    else:
+                        output = variable_computations[variable]["function"](*inputs)
+
+                    for computed in output.data_vars:
+                        variables_to_compute.remove(computed)
+                        datasets[computed] = output[[computed]]
+                        if computed in required_variable_names:
+                            computed_required.append(computed)
                     break
             else:
                 raise RuntimeError(
                     f"Cant compute intermediate variables {variables_to_compute}"
                 )
 
+        if computed_required:
+            computed_required.sort()
+            output_file = Path(workdir) / f"{'+'.join(computed_required)}_{output_basename}"
+            output_ds = xr.merge([datasets[v] for v in computed_required], combine_attrs="override")
+            dataset_to_netcdf(output_ds, output_file)
+            output_files_list.append(output_file)
+
     return output_files_list
 
 
 def get_sub_inputs(variables):
     """From a list of dataset variables, get the source variable names to compute them."""
 
-    output_variables = list(variables)
-    while any(v in variable_computations for v in output_variables):
-        new_output_variables = []
-        for variable in output_variables:
-            if variable in variable_computations:
-                new_output_variables += variable_computations[variable]["inputs"]
-            else:
-                new_output_variables.append(variable)
-        output_variables = new_output_variables
+    output_variables = []
+    to_visit = deque(variables)
+    seen = set()
+    while to_visit:
+        variable = to_visit.popleft()
+        if variable in seen:
+            continue
+        seen.add(variable)
+        if variable in variable_computations:
+            to_visit.extend(variable_computations[variable]["inputs"])
+        else:
+            output_variables.append(variable)
     return output_variables
 
 
+def concat_rcps(ensembles: List[xr.Dataset], rcps: List[str]) -> xr.Dataset:
+    """Concatenate the ensembles of each rcp along a new `rcp` dimension.
+
+    The ensembles are subsetted identically, so their values are copied in a
+    preallocated array instead of going through `xr.concat`. If their coordinates
+    or variables don't match, fall back to `xr.concat`.
+    """
+    first = ensembles[0]
+    try:
+        xr.align(*ensembles, join="exact")
+        same_variables = all(set(e.data_vars) == set(first.data_vars) for e in ensembles)
+    except ValueError:
+        same_variables = False
+    if not same_variables:
+        return xr.concat(ensembles, dim=xr.DataArray(rcps, dims=("rcp",), name="rcp"))
+
+    data_vars = {}
+    for name, da in first.data_vars.items():
+        dtype = np.result_type(*(e[name].dtype for e in ensembles))
+        values = np.empty((len(ensembles),) + da.shape, dtype=dtype)
+        for n, ensemble in enumerate(ensembles):
+            values[n] = ensemble[name].transpose(*da.dims).values
+        data_vars[name] = xr.Variable(("rcp",) + da.dims, values, da.attrs, da.encoding)
+
+    output = xr.Dataset(data_vars, coords=first.coords, attrs=first.attrs)
+    return output.assign_coords(rcp=("rcp", rcps))
+
+
 def ensemble_common_handler(process: Process, request, response, subset_function):
     assert subset_function in [
         finch_subset_bbox,
@@ -536,18 +644,18 @@ def ensemble_common_handler(process: Process, request, response, subset_function
     dataset_name = single_input_or_none(request.inputs, "dataset")
 
     base_work_dir = Path(process.workdir)
-    ensembles = []
-    for rcp in rcps:
+
+    def _ensemble_for_rcp(rcp: str) -> Tuple[str, xr.Dataset]:
         # Ensure no file name conflicts (i.e. if the rcp doesn't appear in the base filename)
+        # The work_dir is passed explicitly, as the rcps can be processed in different threads.
         work_dir = base_work_dir / rcp
         work_dir.mkdir(exist_ok=True)
-        process.set_workdir(str(work_dir))
 
         write_log(process, f"Fetching datasets for rcp={rcp}")
         output_filename = make_output_filename(process, request.inputs, rcp=rcp)
         netcdf_inputs = get_datasets(
             dataset_name,
-            workdir=process.workdir,
+            workdir=str(work_dir),
             variables=list(source_variable_names),
             rcp=rcp,
             models=models,
@@ -556,7 +664,10 @@ def ensemble_common_handler(process: Process, request, response, subset_function
         write_log(process, f"Running subset rcp={rcp}", process_step="subset")
 
         subsetted_files = subset_function(
-            process, netcdf_inputs=netcdf_inputs, request_inputs=request.inputs
+            process,
+            netcdf_inputs=netcdf_inputs,
+            request_inputs=request.inputs,
+            workdir=str(work_dir),
         )
 
         if not subsetted_files:
@@ -564,7 +675,7 @@ def ensemble_common_handler(process: Process, request, response, subset_function
             raise ProcessError(message)
 
         subsetted_intermediate_files = compute_intermediate_variables(
-            subsetted_files, dataset_input_names, process.workdir
+            subsetted_files, dataset_input_names, work_dir
         )
 
         write_log(process, f"Computing indices rcp={rcp}", process_step="compute_indices")
@@ -576,44 +687,54 @@ def ensemble_common_handler(process: Process, request, response, subset_function
 
         indices_files = []
 
-        warnings.filterwarnings("ignore", category=FutureWarning)
-        warnings.filterwarnings("ignore", category=UserWarning)
-
-        for n, inputs in enumerate(input_groups):
-            write_log(
-                process,
-                f"Computing indices for file {n + 1} of {n_groups}, rcp={rcp}",
-                subtask_percentage=n * 100 // n_groups,
-            )
-            output_ds = compute_indices(process, process.xci, inputs)
-
-            output_name = f"{output_filename}_{process.identifier}_{n}.nc"
-            for variable in accepted_variables:
-                if variable in inputs:
-                    input_name = Path(inputs.get(variable)[0].file).name
-                    output_name = input_name.replace(variable, process.identifier)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=FutureWarning)
+            warnings.simplefilter("ignore", category=UserWarning)
 
-            output_path = Path(process.workdir) / output_name
-            dataset_to_netcdf(output_ds, output_path)
-            indices_files.append(output_path)
-
-        warnings.filterwarnings("default", category=FutureWarning)
-        warnings.filterwarnings("default", category=UserWarning)
+            for n, inputs in enumerate(input_groups):
+                write_log(
+                    process,
+                    f"Computing indices for file {n + 1} of {n_groups}, rcp={rcp}",
+                    subtask_percentage=n * 100 // n_groups,
+                )
+                output_ds = compute_indices(process, process.xci, inputs)
+
+                output_name = f"{output_filename}_{process.identifier}_{n}.nc"
+                for variable in accepted_variables:
+                    if variable in inputs:
+                        input_name = Path(inputs.get(variable)[0].file).name
+                        match = _variable_filename_pattern.match(input_name)
+                        if match:
+                            output_name = f"{process.identifier}_{match.group(2)}"
+                        else:
+                            output_name = input_name.replace(variable, process.identifier)
+
+                output_path = work_dir / output_name
+                dataset_to_netcdf(output_ds, output_path)
+                indices_files.append(output_path)
 
-        output_basename = Path(process.workdir) / (output_filename + "_ensemble")
         ensemble = make_ensemble(indices_files, ensemble_percentiles)
         ensemble.attrs['source_datasets'] = '\n'.join([dsinp.url for dsinp in netcdf_inputs])
-        ensembles.append(ensemble)
+        return rcp, ensemble
+
+    # Each rcp is independent: they are processed concurrently only if enabled
+    # in the configuration, separately from the subset threads.
+    ensembles_by_rcp = dict(
+        process_threaded(_ensemble_for_rcp, rcps, threads_option="ensemble_rcp_threads")
+    )
+    ensembles = [ensembles_by_rcp[rcp] for rcp in rcps]
 
-    process.set_workdir(str(base_work_dir))
+    output_filename = make_output_filename(process, request.inputs, rcp="_".join(rcps))
+    # the coordinates in the filename contain dots, the suffixes are appended to the name
+    output_basename = output_filename + "_ensemble"
 
     if len(rcps) > 1:
-        ensemble = xr.concat(ensembles, dim=xr.DataArray(rcps, dims=('rcp',), name='rcp'))
+        ensemble = concat_rcps(ensembles, rcps)
     else:
         ensemble = ensembles[0]
 
     if convert_to_csv:
-        ensemble_csv = output_basename.with_suffix(".csv")
+        ensemble_csv = base_work_dir / (output_basename + ".csv")
         df = dataset_to_dataframe(ensemble)
         df = df.reset_index().set_index(["lat", "lon", "time"])
         if "region" in df.columns:
@@ -622,13 +743,13 @@ def ensemble_common_handler(process: Process, request, response, subset_function
         df.dropna().to_csv(ensemble_csv)
 
         metadata = format_metadata(ensemble)
-        metadata_file = output_basename.parent / f"{ensemble_csv.stem}_metadata.txt"
+        metadata_file = base_work_dir / f"{output_basename}_metadata.txt"
         metadata_file.write_text(metadata)
 
         ensemble_output = Path(process.workdir) / (output_filename + ".zip")
         zip_files(ensemble_output, [metadata_file, ensemble_csv])
     else:
-        ensemble_output = output_basename.with_suffix(".nc")
+        ensemble_output = base_work_dir / (output_basename + ".nc")
         dataset_to_netcdf(ensemble, ensemble_output)
 
     response.outputs["output"].file = ensemble_output
@@ -1,7 +1,8 @@
+from functools import partial
+import itertools
 import logging
 from pathlib import Path
-from threading import Lock
-from typing import List
+from typing import List, Optional
 
 import geopandas as gpd
 from pywps import ComplexInput, Process
@@ -13,6 +14,7 @@ from clisops.core.average import average_shape
 from . import wpsio
 from .utils import (
     RequestInputs,
+    check_opendap_urls,
     process_threaded,
     single_input_or_none,
     try_opendap,
@@ -25,7 +27,10 @@ LOGGER = logging.getLogger("PYWPS")
 
 
 def finch_subset_gridpoint(
-    process: Process, netcdf_inputs: List[ComplexInput], request_inputs: RequestInputs
+    process: Process,
+    netcdf_inputs: List[ComplexInput],
+    request_inputs: RequestInputs,
+    workdir: Optional[str] = None,
 ) -> List[Path]:
     """Parse wps `request_inputs` based on their name and subset `netcdf_inputs`.
 
@@ -34,6 +39,8 @@ def finch_subset_gridpoint(
      - lon: Longitude coordinate, can be a comma separated list of floats
      - start_date: Initial date for temporal subsetting.
      - end_date: Final date for temporal subsetting.
+
+    The output files are written to `workdir`, which defaults to the process workdir.
     """
 
     lon_value = request_inputs[wpsio.lon.identifier][0].data
@@ -53,60 +60,52 @@ def finch_subset_gridpoint(
     variables = [r.data for r in request_inputs.get("variable", [])]
 
     n_files = len(netcdf_inputs)
-    count = 0
+    file_counter = itertools.count(1)
 
     output_files = []
 
-    lock = Lock()
+    # if not subsetting by time, it's not necessary to decode times
+    time_subset = start_date is not None or end_date is not None
+    output_folder = Path(workdir or process.workdir)
+    point_subsets = [
+        partial(subset_gridpoint, lon=longitude, lat=latitude, start_date=start_date, end_date=end_date)
+        for longitude, latitude in zip(longitudes, latitudes)
+    ]
 
     def _subset(resource: ComplexInput):
-        nonlocal count
-
-        # if not subsetting by time, it's not necessary to decode times
-        time_subset = start_date is not None or end_date is not None
-        dataset = try_opendap(resource, decode_times=time_subset)
-
-        with lock:
-            count += 1
-            write_log(
-                process,
-                f"Subsetting file {count} of {n_files} ({resource.file})",
-                subtask_percentage=(count - 1) * 100 // n_files,
-            )
-
-        dataset = dataset[variables] if variables else dataset
-
-        subsets = []
-        for longitude, latitude in zip(longitudes, latitudes):
-            subset = subset_gridpoint(
-                dataset,
-                lon=longitude,
-                lat=latitude,
-                start_date=start_date,
-                end_date=end_date,
-            )
-            subsets.append(subset)
-
-        subsetted = xr.concat(subsets, dim="region")
+        dataset = try_opendap(resource, decode_times=time_subset, variables=variables)
+
+        count = next(file_counter)
+        write_log(
+            process,
+            f"Subsetting file {count} of {n_files} ({resource.file})",
+            subtask_percentage=(count - 1) * 100 // n_files,
+        )
+
+        subsetted = xr.concat([subset(dataset) for subset in point_subsets], dim="region")
 
         if not all(subsetted.dims.values()):
             LOGGER.warning(f"Subset is empty for dataset: {resource.url}")
             return
 
         p = Path(resource.file or resource._build_file_name(resource.url))
-        output_filename = Path(process.workdir) / (p.stem + "_sub" + p.suffix)
+        output_filename = output_folder / (p.stem + "_sub" + p.suffix)
 
         dataset_to_netcdf(subsetted, output_filename)
 
         output_files.append(output_filename)
 
+    check_opendap_urls(r.url for r in netcdf_inputs)
     process_threaded(_subset, netcdf_inputs)
 
     return output_files
 
 
 def finch_subset_bbox(
-    process: Process, netcdf_inputs: List[ComplexInput], request_inputs: RequestInputs
+    process: Process,
+    netcdf_inputs: List[ComplexInput],
+    request_inputs: RequestInputs,
+    workdir: Optional[str] = None,
 ) -> List[Path]:
     """Parse wps `request_inputs` based on their name and subset `netcdf_inputs`.
 
@@ -117,6 +116,8 @@ def finch_subset_bbox(
      - lon1: Longitude coordinate
      - start_date: Initial date for temporal subsetting.
      - end_date: Final date for temporal subsetting.
+
+    The output files are written to `workdir`, which defaults to the process workdir.
     """
     lon0 = single_input_or_none(request_inputs, wpsio.lon0.identifier)
     lat0 = single_input_or_none(request_inputs, wpsio.lat0.identifier)
@@ -131,37 +132,33 @@ def finch_subset_bbox(
         raise ProcessError("lat1 and lon1 must be both omitted or provided")
 
     n_files = len(netcdf_inputs)
-    count = 0
+    file_counter = itertools.count(1)
 
     output_files = []
 
-    lock = Lock()
+    # if not subsetting by time, it's not necessary to decode times
+    time_subset = start_date is not None or end_date is not None
+    output_folder = Path(workdir or process.workdir)
+    bbox_subset = partial(
+        subset_bbox,
+        lon_bnds=[lon0, lon1],
+        lat_bnds=[lat0, lat1],
+        start_date=start_date,
+        end_date=end_date,
+    )
 
     def _subset(resource):
-        nonlocal count
-
-        # if not subsetting by time, it's not necessary to decode times
-        time_subset = start_date is not None or end_date is not None
-        dataset = try_opendap(resource, decode_times=time_subset)
+        dataset = try_opendap(resource, decode_times=time_subset, variables=variables)
 
-        with lock:
-            count += 1
-            write_log(
-                process,
-                f"Subsetting file {count} of {n_files} ({resource.file})",
-                subtask_percentage=(count - 1) * 100 // n_files,
-            )
-
-        dataset = dataset[variables] if variables else dataset
+        count = next(file_counter)
+        write_log(
+            process,
+            f"Subsetting file {count} of {n_files} ({resource.file})",
+            subtask_percentage=(count - 1) * 100 // n_files,
+        )
 
         try:
-            subsetted = subset_bbox(
-                dataset,
-                lon_bnds=[lon0, lon1],
-                lat_bnds=[lat0, lat1],
-                start_date=start_date,
-                end_date=end_date,
-            )
+            subsetted = bbox_subset(dataset)
         except ValueError:
             subsetted = False
 
@@ -170,12 +167,13 @@ def finch_subset_bbox(
             return
 
         p = Path(resource.file or resource._build_file_name(resource.url))
-        output_filename = Path(process.workdir) / (p.stem + "_sub" + p.suffix)
+        output_filename = output_folder / (p.stem + "_sub" + p.suffix)
 
         dataset_to_netcdf(subsetted, output_filename)
 
         output_files.append(output_filename)
 
+    check_opendap_urls(r.url for r in netcdf_inputs)
     process_threaded(_subset, netcdf_inputs)
 
     return output_files
@@ -206,7 +204,10 @@ def extract_shp(path):
 
 
 def finch_average_shape(
-    process: Process, netcdf_inputs: List[ComplexInput], request_inputs: RequestInputs,
+    process: Process,
+    netcdf_inputs: List[ComplexInput],
+    request_inputs: RequestInputs,
+    workdir: Optional[str] = None,
 ) -> List[Path]:
     """Parse wps `request_inputs` based on their name and average `netcdf_inputs`.
 
@@ -214,6 +215,8 @@ def finch_average_shape(
      - shape: Polygon contour to average the data over.
      - start_date: Initial date for temporal subsetting.
      - end_date: Final date for temporal subsetting.
+
+    The output files are written to `workdir`, which defaults to the process workdir.
     """
     shp = Path(request_inputs[wpsio.shape.identifier][0].file)
     if shp.suffix == ".zip":
@@ -229,28 +232,25 @@ def finch_average_shape(
         shape['geometry'] = shape.simplify(tolerance)
 
     n_files = len(netcdf_inputs)
-    count = 0
+    file_counter = itertools.count(1)
 
     output_files = []
 
-    lock = Lock()
+    # if not subsetting by time, it's not necessary to decode times
+    time_subset = start_date is not None or end_date is not None
+    output_folder = Path(workdir or process.workdir)
 
     def _average(resource):
-        nonlocal count
-
-        # if not subsetting by time, it's not necessary to decode times
-        time_subset = start_date is not None or end_date is not None
-        dataset = try_opendap(resource, decode_times=time_subset, chunk_dims=['time', 'realization'])
-
-        with lock:
-            count += 1
-            write_log(
-                process,
-                f"Averaging file {count} of {n_files} ({resource.file})",
-                subtask_percentage=(count - 1) * 100 // n_files,
-            )
+        dataset = try_opendap(
+            resource, decode_times=time_subset, chunk_dims=['time', 'realization'], variables=variables
+        )
 
-        dataset = dataset[variables] if variables else dataset
+        count = next(file_counter)
+        write_log(
+            process,
+            f"Averaging file {count} of {n_files} ({resource.file})",
+            subtask_percentage=(count - 1) * 100 // n_files,
+        )
 
         if time_subset:
             dataset = subset_time(dataset, start_date=start_date, end_date=end_date)
@@ -261,19 +261,23 @@ def finch_average_shape(
             return
 
         p = Path(resource.file or resource._build_file_name(resource.url))
-        output_filename = Path(process.workdir) / (p.stem + "_avg" + p.suffix)
+        output_filename = output_folder / (p.stem + "_avg" + p.suffix)
 
         dataset_to_netcdf(averaged, output_filename)
 
         output_files.append(output_filename)
 
+    check_opendap_urls(r.url for r in netcdf_inputs)
     process_threaded(_average, netcdf_inputs)
 
     return output_files
 
 
 def finch_subset_shape(
-    process: Process, netcdf_inputs: List[ComplexInput], request_inputs: RequestInputs,
+    process: Process,
+    netcdf_inputs: List[ComplexInput],
+    request_inputs: RequestInputs,
+    workdir: Optional[str] = None,
 ) -> List[Path]:
     """Parse wps `request_inputs` based on their name and subset `netcdf_inputs`.
 
@@ -281,6 +285,8 @@ def finch_subset_shape(
      - shape: Polygon contour to subset the data with.
      - start_date: Initial date for temporal subsetting.
      - end_date: Final date for temporal subsetting.
+
+    The output files are written to `workdir`, which defaults to the process workdir.
     """
     shp = Path(request_inputs[wpsio.shape.identifier][0].file)
     if shp.suffix == ".zip":
@@ -291,28 +297,23 @@ def finch_subset_shape(
     variables = [r.data for r in request_inputs.get("variable", [])]
 
     n_files = len(netcdf_inputs)
-    count = 0
+    file_counter = itertools.count(1)
 
     output_files = []
 
-    lock = Lock()
+    # if not subsetting by time, it's not necessary to decode times
+    time_subset = start_date is not None or end_date is not None
+    output_folder = Path(workdir or process.workdir)
 
     def _subset(resource):
-        nonlocal count
-
-        # if not subsetting by time, it's not necessary to decode times
-        time_subset = start_date is not None or end_date is not None
-        dataset = try_opendap(resource, decode_times=time_subset)
+        dataset = try_opendap(resource, decode_times=time_subset, variables=variables)
 
-        with lock:
-            count += 1
-            write_log(
-                process,
-                f"Subsetting file {count} of {n_files} ({resource.file})",
-                subtask_percentage=(count - 1) * 100 // n_files,
-            )
-
-        dataset = dataset[variables] if variables else dataset
+        count = next(file_counter)
+        write_log(
+            process,
+            f"Subsetting file {count} of {n_files} ({resource.file})",
+            subtask_percentage=(count - 1) * 100 // n_files,
+        )
 
         subsetted = subset_shape(
             dataset, shape=shp, start_date=start_date, end_date=end_date,
@@ -323,12 +324,13 @@ def finch_subset_shape(
             return
 
         p = Path(resource.file or resource._build_file_name(resource.url))
-        output_filename = Path(process.workdir) / (p.stem + "_sub" + p.suffix)
+        output_filename = output_folder / (p.stem + "_sub" + p.suffix)
 
         dataset_to_netcdf(subsetted, output_filename)
 
         output_files.append(output_filename)
 
+    check_opendap_urls(r.url for r in netcdf_inputs)
     process_threaded(_subset, netcdf_inputs)
 
     return output_files
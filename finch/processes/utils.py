@@ -1,9 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import logging
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
 import re
 import json
+import threading
 from typing import (
     Callable,
     Deque,
@@ -12,13 +14,13 @@ from typing import (
     Iterable,
     List,
     Optional,
+    TextIO,
     Tuple,
     Union,
 )
 import zipfile
 
 import cftime
-import netCDF4
 import numpy as np
 import pandas as pd
 from pywps import (
@@ -34,6 +36,7 @@ from pywps import (
 )
 from pywps.inout.outputs import MetaFile, MetaLink4
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, InvalidSchema, MissingSchema
 import sentry_sdk
 import xarray as xr
@@ -49,12 +52,51 @@ RequestInputs = Dict[str, Deque[PywpsInput]]
 # These are parameters that set options. They are not `compute` arguments.
 INDICATOR_OPTIONS = ['check_missing', 'missing_options', "cf_compliance", "data_validation"]
 
+# Deflate level of the text files in zip archives: csv files compress well even at the fastest level
+ZIP_COMPRESSION_LEVEL = 1
+
+# Results of `is_opendap_url`, by url
+_opendap_urls: Dict[str, bool] = {}
+OPENDAP_URLS_CACHE_SIZE = 4096
+# Maximum number of urls checked at the same time by `check_opendap_urls`
+OPENDAP_CHECK_WORKERS = 16
+
+# Shared by the requests to the data servers, so that connections are reused
+_http_session = requests.Session()
+for _prefix in ("http://", "https://"):
+    _http_session.mount(_prefix, HTTPAdapter(pool_maxsize=OPENDAP_CHECK_WORKERS))
+
+# Log files kept open for the duration of a process, by path
+_log_files: Dict[Path, TextIO] = {}
+_log_files_lock = threading.Lock()
+# pywps rewrites the whole status document on each update, they are made one at a time
+_status_lock = threading.Lock()
+
 
 def log_file_path(process: Process) -> Path:
     """Returns the filepath to write the process logfile."""
     return Path(process.workdir) / "log.txt"
 
 
+def _write_log_file(process: Process, message: str) -> None:
+    """Append a line to the process logfile, which is opened once and kept open."""
+    path = log_file_path(process)
+    with _log_files_lock:
+        log_file = _log_files.get(path)
+        if log_file is None:
+            # line buffered, so that the file is complete after each message
+            log_file = _log_files[path] = path.open("a", encoding="utf8", buffering=1)
+        log_file.write(message + "\n")
+
+
+def close_log_file(process: Process) -> None:
+    """Close the process logfile, if it was opened by `write_log`."""
+    with _log_files_lock:
+        log_file = _log_files.pop(log_file_path(process), None)
+    if log_file is not None:
+        log_file.close()
+
+
 def write_log(
     process: Process,
     message: str,
@@ -69,6 +111,8 @@ def write_log(
      - To a log file stored in the process working directory
      - Update the response document with the message and the status percentage
 
+    It can be called from multiple threads, the status updates are serialized.
+
     subtask_percentage: not the percentage of the whole process, but the percent done
     in the current processing step. (see `process.status_percentage_steps`)
     """
@@ -99,9 +143,10 @@ def write_log(
         status_percentage = current_step_percentage + int(sub_percentage)
 
     if level >= logging.INFO:
-        log_file_path(process).open("a", encoding="utf8").write(message + "\n")
+        _write_log_file(process, message)
         try:
-            process.response.update_status(message, status_percentage=status_percentage)
+            with _status_lock:
+                process.response.update_status(message, status_percentage=status_percentage)
         except AttributeError:
             pass
 
@@ -136,6 +181,9 @@ def compute_indices(
 
     variable = kwds.pop("variable", None)
 
+    # multiple inputs can be read from the same file (ex: tn10 and tn90)
+    opened_datasets: Dict[str, xr.Dataset] = {}
+
     for name, input_queue in inputs.items():
         input = input_queue[0]
 
@@ -145,7 +193,11 @@ def compute_indices(
                 kwds[name] = json.loads(input.data)
 
             elif input.supported_formats[0] in [FORMATS.NETCDF, FORMATS.DODS]:
-                ds = try_opendap(input, logging_function=lambda msg: write_log(process, msg))
+                if input.url not in opened_datasets:
+                    opened_datasets[input.url] = try_opendap(
+                        input, logging_function=lambda msg: write_log(process, msg)
+                    )
+                ds = opened_datasets[input.url]
                 global_attributes = global_attributes or ds.attrs
                 vars = list(ds.data_vars.values())
 
@@ -289,17 +341,20 @@ def try_opendap(
     chunks=None,
     decode_times=True,
     chunk_dims=None,
+    variables: Optional[List[str]] = None,
     logging_function=lambda message: None,
 ) -> xr.Dataset:
     """Try to open the file as an OPeNDAP url and chunk it.
 
     If OPeNDAP fails, access the file directly.
+    If `variables` is given, only these data variables are kept, before chunking.
     """
     url = input.url
     logging_function(f"Try opening DAP link {url}")
 
     if is_opendap_url(url):
         ds = xr.open_dataset(url, chunks=chunks, decode_times=decode_times)
+        ds = ds[variables] if variables else ds
         logging_function(f"Opened dataset as an OPeNDAP url: {url}")
     else:
         if url.startswith("http"):
@@ -309,20 +364,76 @@ def try_opendap(
             logging_function(f"Opening as local file: {input.file}")
 
         ds = xr.open_dataset(input.file, chunks=chunks, decode_times=decode_times)
+        ds = ds[variables] if variables else ds
 
         # To handle large number of grid cells (50+) in subsetted data
         if "region" in ds.dims and "time" in ds.dims:
             chunks = dict(time=-1, region=5)
             ds = ds.chunk(chunks)
     if not chunks:
-        ds = ds.chunk(chunk_dataset(ds, max_size=1000000, chunk_dims=chunk_dims))
+        # Align dask chunks with the chunks found on disk, so that each
+        # chunk of the file is read only once.
+        chunks = encoded_chunks(ds, max_size=1000000, chunk_dims=chunk_dims)
+        if not chunks:
+            chunks = chunk_dataset(ds, max_size=1000000, chunk_dims=chunk_dims)
+        ds = ds.chunk(chunks)
     return ds
 
 
-def process_threaded(function: Callable, inputs: Iterable):
-    """Based on the current configuration, process a list threaded or not."""
+def encoded_chunks(ds: xr.Dataset, max_size=1000000, chunk_dims=None) -> Dict[str, int]:
+    """Returns chunk sizes aligned with the chunks of the data variables stored in the file.
+
+    The chunk sizes are read from the `chunksizes` encoding, or from the `_ChunkSizes`
+    attribute that OPeNDAP servers add to chunked variables. The chunk sizes computed by
+    `chunk_dataset` are then rounded down to a multiple of the chunk on disk, or to a divisor
+    of it when the chunk on disk is larger, so that the chunked size stays below max_size
+    and no dask chunk overlaps two chunks on disk.
+    If chunk_dims is given, only those dimensions are chunked.
 
-    threads = int(configuration.get_config_value("finch", "subset_threads"))
+    Returns an empty dict if no chunking information is found.
+    """
+    disk_chunks = {}
+    for variable in sorted(ds.data_vars.values(), key=lambda v: v.ndim, reverse=True):
+        sizes = variable.encoding.get("chunksizes") or variable.attrs.get("_ChunkSizes")
+        if sizes is None:
+            continue
+        sizes = np.atleast_1d(sizes)
+        if len(sizes) != len(variable.dims):
+            continue
+        for dim, size in zip(variable.dims, sizes):
+            if chunk_dims is None or dim in chunk_dims:
+                disk_chunks.setdefault(dim, int(size))
+
+    if not disk_chunks:
+        return {}
+
+    chunks = chunk_dataset(ds, max_size=max_size, chunk_dims=chunk_dims)
+    for dim, disk_chunk in disk_chunks.items():
+        chunks[dim] = _aligned_chunk(chunks[dim], disk_chunk, ds.sizes[dim])
+    return chunks
+
+
+def _aligned_chunk(target: int, disk_chunk: int, size: int) -> int:
+    """Round down a chunk size to a multiple or a divisor of the chunk size on disk."""
+    if target >= size:
+        return size
+    if target >= disk_chunk:
+        return target // disk_chunk * disk_chunk
+    if disk_chunk >= size:
+        # a single chunk on disk along this dimension, no dask chunk can overlap two of them
+        return target
+    return next(n for n in range(target, 0, -1) if disk_chunk % n == 0)
+
+
+def process_threaded(function: Callable, inputs: Iterable, threads_option: str = "subset_threads"):
+    """Based on the current configuration, process a list threaded or not.
+
+    `threads_option` is the option of the `finch` configuration section giving the number of threads.
+    No more threads than there are inputs are started.
+    """
+
+    inputs = list(inputs)
+    threads = min(int(configuration.get_config_value("finch", threads_option)), len(inputs))
     if threads > 1:
         pool = ThreadPool(processes=threads)
         outputs = list(pool.imap_unordered(function, inputs))
@@ -337,13 +448,12 @@ def process_threaded(function: Callable, inputs: Iterable):
 def chunk_dataset(ds, max_size=1000000, chunk_dims=None):
     """Ensures the chunked size of a xarray.Dataset is below a certain size.
 
-    Cycle through the dimensions, divide the chunk size by 2 until criteria is met.
-    If chunk_dims is given, limits the chunking to those dimensions, if they are
-    found in the dataset.
+    Cycle through the dimensions (largest first), divide the chunk size by 2 until
+    criteria is met. If chunk_dims is given, limits the chunking to those dimensions,
+    if they are found in the dataset.
     """
     from functools import reduce
     from operator import mul
-    from itertools import cycle
 
     chunks = dict(ds.sizes)
 
@@ -355,13 +465,18 @@ def chunk_dataset(ds, max_size=1000000, chunk_dims=None):
         )
         return chunks
 
-    def chunk_size():
-        return reduce(mul, chunks.values())
+    dims = sorted(dims, key=lambda d: chunks[d], reverse=True)
 
-    for dim in cycle(dims):
-        if chunk_size() < max_size:
-            break
-        chunks[dim] = max(chunks[dim] // 2, 1)
+    # keep the running product up to date instead of recomputing it at each step
+    chunk_size = reduce(mul, chunks.values(), 1)
+
+    while chunk_size >= max_size and any(chunks[d] > 1 for d in dims):
+        for dim in dims:
+            if chunk_size < max_size:
+                break
+            halved = max(chunks[dim] // 2, 1)
+            chunk_size = chunk_size // chunks[dim] * halved
+            chunks[dim] = halved
 
     return chunks
 
@@ -386,6 +501,14 @@ def make_metalink_output(
     return metalink
 
 
+def check_opendap_urls(urls: Iterable[str], max_workers=OPENDAP_CHECK_WORKERS) -> None:
+    """Check concurrently if urls are OpenDAP urls, so that `is_opendap_url` answers from its cache."""
+    urls = [u for u in set(urls) if u.startswith("http") and u not in _opendap_urls]
+    if len(urls) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+            list(executor.map(is_opendap_url, urls))
+
+
 def is_opendap_url(url):
     """
     Check if a provided url is an OpenDAP url.
@@ -398,25 +521,26 @@ def is_opendap_url(url):
 
     Even then, some OpenDAP servers seem to not include the specified header...
     So we need to let the netCDF4 library actually open the file.
+
+    The answers of the servers are cached, failed requests and error responses are not.
     """
+    if url in _opendap_urls:
+        return _opendap_urls[url]
+
     try:
-        content_description = requests.head(url, timeout=5).headers.get(
-            "Content-Description"
-        )
+        response = _http_session.head(url, timeout=5)
     except (ConnectionError, MissingSchema, InvalidSchema):
         return False
-
-    if content_description:
-        return content_description.lower().startswith("dods")
-    else:
+    if not response.ok:
+        # the server could be temporarily unavailable, check again next time
         return False
 
-        try:
-            # For a non-DAP URL, this just hangs python.
-            dataset = netCDF4.Dataset(url)
-        except OSError:
-            return False
-        return dataset.disk_format in ("DAP2", "DAP4")
+    content_description = response.headers.get("Content-Description")
+    if len(_opendap_urls) >= OPENDAP_URLS_CACHE_SIZE:
+        _opendap_urls.clear()
+    is_opendap = bool(content_description) and content_description.lower().startswith("dods")
+    _opendap_urls[url] = is_opendap
+    return is_opendap
 
 
 def single_input_or_none(inputs, identifier) -> Optional[str]:
@@ -510,12 +634,15 @@ def dataset_to_dataframe(ds: xr.Dataset) -> pd.DataFrame:
     if not np.all(ds.time.dt.hour == 12):
         attrs = ds.time.attrs
 
-        # np.datetime64 doesn't have the 'replace' method
         time_values = ds.time.values
-        if not hasattr(time_values[0], "replace"):
-            time_values = pd.to_datetime(time_values)
-
-        ds["time"] = [y.replace(hour=12) for y in time_values]
+        if np.issubdtype(time_values.dtype, np.datetime64):
+            # same as `replace(hour=12)`, for the whole array at once
+            within_hour = time_values - time_values.astype("datetime64[h]")
+            days = time_values.astype("datetime64[D]")
+            ds["time"] = days + np.timedelta64(12, "h") + within_hour
+        else:
+            # cftime dates
+            ds["time"] = [y.replace(hour=12) for y in time_values]
         ds.time.attrs = attrs
 
     return ds.to_dataframe()
@@ -556,10 +683,18 @@ def zip_files(
 ):
     """Create a zipfile from a list of files or folders.
 
-    log_function is a function that receives a message and a percentage."""
+    NetCDF files are stored without compression, as compressing them again
+    takes time for almost no reduction in size. Other files (csv, metadata) are deflated
+    at the fastest level.
+
+    log_function is a function that receives a message and a percentage.
+    It is called at most once for each percentage."""
     log_function = log_function or (lambda *a: None)
     with zipfile.ZipFile(
-        output_filename, mode="w", compression=zipfile.ZIP_DEFLATED
+        output_filename,
+        mode="w",
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=ZIP_COMPRESSION_LEVEL,
     ) as z:
         all_files = []
         for file in files:
@@ -578,14 +713,20 @@ def zip_files(
                 break
 
         n_files = len(all_files)
+        scale = 100 / n_files if n_files else 0
+        last_percentage = None
         for n, filename in enumerate(all_files):
 
-            percentage = int(n / n_files * 100)
-            message = f"Zipping file {n + 1} of {n_files}"
-            log_function(message, percentage)
+            # only log when the percentage changes, each status update is costly
+            percentage = int(n * scale)
+            if percentage != last_percentage:
+                log_function(f"Zipping file {n + 1} of {n_files}", percentage)
+                last_percentage = percentage
 
             arcname = filename.relative_to(common_folder) if common_folder else None
-            z.write(filename, arcname=arcname)
+            # the other files use the archive's compression and level
+            compress_type = zipfile.ZIP_STORED if filename.suffix == ".nc" else None
+            z.write(filename, arcname=arcname, compress_type=compress_type)
 
 
 def make_tasmin_tasmax_pairs(
@@ -642,9 +783,15 @@ def fix_broken_time_index(ds: xr.Dataset):
 
 
 def dataset_to_netcdf(
-    ds: xr.Dataset, output_path: Union[Path, str], compression_level=0
+    ds: xr.Dataset, output_path: Union[Path, str], compression_level=1
 ) -> None:
-    """Write an :class:`xarray.Dataset` dataset to disk, optionally using compression."""
+    """Write an :class:`xarray.Dataset` dataset to disk, optionally using compression.
+
+    When compressing, dask data variables are stored in chunks matching their dask chunks.
+    Other data variables are chunked with the whole time dimension in each chunk,
+    as they are mostly read as full time series (ex: to compute ensembles).
+    A compression_level of 0 writes the variables without compression or chunking.
+    """
     encoding = {}
 
     if "time" in ds.dims:
@@ -654,6 +801,39 @@ def dataset_to_netcdf(
         fix_broken_time_index(ds)
     if compression_level:
         for v in ds.data_vars:
-            encoding[v] = {"zlib": True, "complevel": compression_level}
+            encoding[v] = _compressed_encoding(ds[v], compression_level)
 
     ds.to_netcdf(str(output_path), format="NETCDF4", encoding=encoding)
+
+
+# encoding keys of the source variable that are kept when writing it
+_KEPT_ENCODING_KEYS = ("dtype", "_FillValue", "missing_value", "scale_factor", "add_offset", "units", "calendar")
+
+
+def _compressed_encoding(da: xr.DataArray, compression_level: int) -> Dict:
+    """Encoding of a variable using compression.
+
+    The chunks on disk are the dask chunks of the variable, or span the time dimension if
+    the variable is not a dask array.
+    """
+    # Passing an encoding for a variable replaces its encoding, keep the relevant parts
+    encoding = {k: v for k, v in da.encoding.items() if k in _KEPT_ENCODING_KEYS}
+
+    if da.ndim == 0 or da.dtype.kind not in "biufcmM":
+        return encoding
+
+    encoding.update(zlib=True, complevel=compression_level, shuffle=True)
+
+    if da.chunks is not None:
+        # dask writes one block at a time: chunks on disk spanning several blocks would
+        # be read back, decompressed and rewritten for each of them
+        encoding["chunksizes"] = tuple(max(c[0], 1) for c in da.chunks)
+        return encoding
+
+    other_dims = [d for d in da.dims if d != "time"]
+    chunks = dict(da.sizes)
+    if other_dims:
+        chunks = chunk_dataset(da, max_size=1000000, chunk_dims=other_dims)
+    encoding["chunksizes"] = tuple(chunks[d] for d in da.dims)
+
+    return encoding
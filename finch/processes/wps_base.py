@@ -1,18 +1,21 @@
 import logging
 import io
-from typing import Dict, List
+from copy import deepcopy
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
 from dask.diagnostics import ProgressBar
 from pywps import ComplexInput, FORMATS, LiteralInput, Process
 from pywps.app.exceptions import ProcessError
 from pywps.app.Common import Metadata
 from sentry_sdk import configure_scope
+from unidecode import unidecode
 import xclim
 
 from xclim.core.utils import InputKind
 
 from .constants import xclim_netcdf_variables
-from .utils import PywpsInput
+from .utils import PywpsInput, close_log_file
 
 
 LOGGER = logging.getLogger("PYWPS")
@@ -42,6 +45,8 @@ class FinchProcess(Process):
         except Exception as err:
             LOGGER.exception('FinchProcess handler wrapper failed with:')
             raise ProcessError(f"Finch failed with {err!r}")
+        finally:
+            close_log_file(self)
 
     def sentry_configure_scope(self, request):
         """Add additional data to sentry error messages.
@@ -114,6 +119,32 @@ def make_xclim_indicator_process(
     return process  # type: ignore
 
 
+@lru_cache(maxsize=None)
+def ascii_text(text: str) -> str:
+    """Transliterate a title or abstract to ASCII.
+
+    The same indicator texts are used by multiple processes, so the results are cached.
+    """
+    if text.isascii():
+        return text
+    return unidecode(text)
+
+
+def xclim_indicator_attributes_and_inputs(process_class) -> Tuple[Dict, List[PywpsInput]]:
+    """Returns the json attributes of a process class's xclim indicator, and its pywps inputs.
+
+    They are computed once for each process class. The inputs are copied on every call,
+    because pywps modifies them in place.
+    """
+    cached = process_class.__dict__.get("_xci_cache")
+    if cached is None:
+        attrs = process_class.xci.json()
+        inputs = convert_xclim_inputs_to_pywps(attrs["parameters"], process_class.xci.identifier)
+        cached = process_class._xci_cache = (attrs, inputs)
+    attrs, inputs = cached
+    return attrs, deepcopy(inputs)
+
+
 def convert_xclim_inputs_to_pywps(params: Dict, parent=None) -> List[PywpsInput]:
     """Convert xclim indicators properties to pywps inputs."""
     # Ideally this would be based on the Parameters docstring section rather than name conventions.
@@ -1,11 +1,9 @@
 import logging
 
-from unidecode import unidecode
-
 from finch.processes.subset import finch_subset_gridpoint
 
 from . import wpsio
-from .wps_base import FinchProcess, convert_xclim_inputs_to_pywps
+from .wps_base import FinchProcess, ascii_text, xclim_indicator_attributes_and_inputs
 from .ensemble_utils import ensemble_common_handler
 from .constants import xclim_netcdf_variables
 
@@ -27,8 +25,7 @@ class XclimEnsembleGridPointBase(FinchProcess):
                 "Use the `finch.processes.wps_base.make_xclim_indicator_process` function instead."
             )
 
-        attrs = self.xci.json()
-        xci_inputs = convert_xclim_inputs_to_pywps(attrs["parameters"], self.xci.identifier)
+        attrs, xci_inputs = xclim_indicator_attributes_and_inputs(type(self))
         xci_inputs.extend(wpsio.xclim_common_options)
         self.xci_inputs_identifiers = [i.identifier for i in xci_inputs]
 
@@ -39,7 +36,7 @@ class XclimEnsembleGridPointBase(FinchProcess):
             wpsio.end_date,
             wpsio.ensemble_percentiles,
             wpsio.dataset_name,
-            wpsio.copy_io(wpsio.rcp, min_occurs=1, max_occurs=3),
+            wpsio.rcp_required,
             wpsio.models,
         ]
 
@@ -57,8 +54,8 @@ class XclimEnsembleGridPointBase(FinchProcess):
             self._handler,
             identifier=identifier,
             version="0.1",
-            title=unidecode(attrs["title"]),
-            abstract=unidecode(attrs["abstract"]),
+            title=ascii_text(attrs["title"]),
+            abstract=ascii_text(attrs["abstract"]),
             inputs=inputs,
             outputs=outputs,
             status_supported=True,
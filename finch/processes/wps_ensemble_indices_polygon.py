@@ -1,9 +1,7 @@
 import logging
 
-from unidecode import unidecode
-
 from . import wpsio
-from .wps_base import FinchProcess, convert_xclim_inputs_to_pywps
+from .wps_base import FinchProcess, ascii_text, xclim_indicator_attributes_and_inputs
 from .ensemble_utils import ensemble_common_handler
 from .constants import xclim_netcdf_variables
 from .subset import finch_subset_shape
@@ -26,8 +24,7 @@ class XclimEnsemblePolygonBase(FinchProcess):
                 "Use the `finch.processes.wps_base.make_xclim_indicator_process` function instead."
             )
 
-        attrs = self.xci.json()
-        xci_inputs = convert_xclim_inputs_to_pywps(attrs["parameters"], self.xci.identifier)
+        attrs, xci_inputs = xclim_indicator_attributes_and_inputs(type(self))
         xci_inputs.extend(wpsio.xclim_common_options)
         self.xci_inputs_identifiers = [i.identifier for i in xci_inputs]
 
@@ -37,7 +34,7 @@ class XclimEnsemblePolygonBase(FinchProcess):
             wpsio.end_date,
             wpsio.ensemble_percentiles,
             wpsio.dataset_name,
-            wpsio.copy_io(wpsio.rcp, min_occurs=1, max_occurs=3),
+            wpsio.rcp_required,
             wpsio.models,
         ]
 
@@ -55,8 +52,8 @@ class XclimEnsemblePolygonBase(FinchProcess):
             self._handler,
             identifier=identifier,
             version="0.1",
-            title=unidecode(attrs["title"]),
-            abstract=unidecode(attrs["abstract"]),
+            title=ascii_text(attrs["title"]),
+            abstract=ascii_text(attrs["abstract"]),
             inputs=inputs,
             outputs=outputs,
             status_supported=True,
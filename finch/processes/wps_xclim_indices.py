@@ -5,7 +5,6 @@ from typing import List
 
 from pywps import ComplexOutput, FORMATS
 from pywps.app.exceptions import ProcessError
-from unidecode import unidecode
 import xarray as xr
 
 from . import wpsio
@@ -21,6 +20,7 @@ from .utils import (
 from .wps_base import (
     FinchProcess,
     FinchProgressBar,
+    ascii_text,
     convert_xclim_inputs_to_pywps,
 )
 
@@ -63,8 +63,8 @@ class XclimIndicatorBase(FinchProcess):
             self._handler,
             identifier=self.xci.identifier,
             version="0.1",
-            title=unidecode(self.xci.title),
-            abstract=unidecode(self.xci.abstract),
+            title=ascii_text(self.xci.title),
+            abstract=ascii_text(self.xci.abstract),
             inputs=inputs,
             outputs=outputs,
             status_supported=True,
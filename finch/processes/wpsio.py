@@ -1,8 +1,9 @@
 """Module storing inputs and outputs used in multiple processes. """
 
 import json
-from copy import deepcopy
+from copy import copy
 from typing import Union
+import weakref
 
 from pywps import FORMATS, ComplexInput, ComplexOutput, LiteralInput
 from pywps.inout.literaltypes import AnyValue
@@ -29,7 +30,17 @@ def copy_io(
     This is necessary because if we modify the input or output directly,
     every other place where this input is used would be affected.
     """
-    new_io = deepcopy(io)
+    new_io = copy(io)
+    # Containers (allowed values, formats, metadata, ...) are copied so that they are not
+    # shared, their items are immutable definitions left as is.
+    for k, v in vars(io).items():
+        if isinstance(v, (list, dict)):
+            setattr(new_io, k, copy(v))
+    # The io handler holds a weak reference to the io it belongs to
+    handler = getattr(io, "_iohandler", None)
+    if handler is not None:
+        new_io._iohandler = copy(handler)
+        new_io._iohandler._ref = weakref.ref(new_io)
     for k, v in kwargs.items():
         setattr(new_io, k, v)
     return new_io
@@ -118,7 +129,7 @@ variable = LiteralInput(
     data_type="string",
     default=None,
     min_occurs=0,
-    allowed_values=["tasmin", "tasmax", "pr"],
+    allowed_values=("tasmin", "tasmax", "pr"),
 )
 
 variable_any = copy_io(variable, any_value=True, allowed_values=[AnyValue])
@@ -130,7 +141,7 @@ dataset_name = LiteralInput(
     data_type="string",
     default=None,
     min_occurs=0,
-    allowed_values=["bccaqv2"],
+    allowed_values=("bccaqv2",),
 )
 
 rcp = LiteralInput(
@@ -140,9 +151,11 @@ rcp = LiteralInput(
     data_type="string",
     default=None,
     min_occurs=0,
-    allowed_values=["rcp26", "rcp45", "rcp85"],
+    allowed_values=("rcp26", "rcp45", "rcp85"),
 )
 
+rcp_required = copy_io(rcp, min_occurs=1, max_occurs=3)
+
 models = LiteralInput(
     "models",
     "Models to include in ensemble",
@@ -183,7 +196,7 @@ check_missing = LiteralInput(
     abstract="Method used to determine which aggregations should be considered missing.",
     data_type="string",
     default=OPTIONS[CHECK_MISSING],
-    allowed_values=list(MISSING_METHODS.keys()),
+    allowed_values=tuple(MISSING_METHODS),
     min_occurs=0,
 )
 
@@ -204,7 +217,7 @@ cf_compliance = LiteralInput(
     abstract="Whether to log, warn or raise when inputs have non-CF-compliant attributes.",
     data_type="string",
     default=OPTIONS[CF_COMPLIANCE],
-    allowed_values=['log', 'warn', 'raise'],
+    allowed_values=('log', 'warn', 'raise'),
     min_occurs=0,
 )
 
@@ -215,7 +228,7 @@ data_validation = LiteralInput(
     abstract="Whether to log, warn or raise when inputs fail data validation checks.",
     data_type="string",
     default=OPTIONS[DATA_VALIDATION],
-    allowed_values=['log', 'warn', 'raise'],
+    allowed_values=('log', 'warn', 'raise'),
     min_occurs=0,
 )
 
@@ -225,7 +238,7 @@ output_format_netcdf_csv = LiteralInput(
     "Output format choice",
     abstract="Choose in which format you want to recieve the result",
     data_type="string",
-    allowed_values=["netcdf", "csv"],
+    allowed_values=("netcdf", "csv"),
     default="netcdf",
     min_occurs=0,
 )
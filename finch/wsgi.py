@@ -1,17 +1,17 @@
 import os
 
-import sentry_sdk
+from pywps import configuration
 from pywps.app.Service import Service
 
-from .processes import get_processes
-
 SENTRY_ENV = os.environ.get("SENTRY_ENV", "production")
 
 if os.environ.get("SENTRY_DSN"):
+    import sentry_sdk
+
     sentry_sdk.init(os.environ["SENTRY_DSN"], SENTRY_ENV)
 
 
-def create_app(cfgfiles=None):
+def _config_files(cfgfiles=None):
     config_files = [os.path.join(os.path.dirname(__file__), "default.cfg")]
     if isinstance(cfgfiles, str):
         cfgfiles = [cfgfiles]
@@ -19,7 +19,15 @@ def create_app(cfgfiles=None):
         config_files += cfgfiles
     if "PYWPS_CFG" in os.environ:
         config_files.append(os.environ["PYWPS_CFG"])
-    service = Service(cfgfiles=config_files)
+    return config_files
+
+
+def create_app(cfgfiles=None):
+    # The processes (and xclim) are only imported when creating the application
+    from .processes import get_processes
+
+    # The default configuration files are already loaded on import
+    service = Service(cfgfiles=_config_files(cfgfiles) if cfgfiles else None)
 
     # delay the call to get_processes() so that the configuration is loaded
     # when instantiating the service
@@ -28,4 +36,14 @@ def create_app(cfgfiles=None):
     return service
 
 
-application = create_app()
+# The configuration is loaded on import, as it was when the application was created on import.
+configuration.load_configuration(_config_files())
+
+
+def __getattr__(name):
+    # The application is created when it is first accessed (ex: by the wsgi server),
+    # so that importing this module (ex: from the cli) doesn't instantiate every process.
+    if name == "application":
+        application = globals()["application"] = create_app()
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,22 +1,31 @@
-from pywps import get_ElementMakerForVersion
+from lxml import etree
+from pywps import get_ElementMakerForVersion, namespaces100
 from pywps.app.basic import get_xpath_ns
 from pywps.tests import WpsClient, WpsTestResponse
 from pathlib import Path
+from urllib.parse import urlencode
 
 VERSION = "1.0.0"
 WPS, OWS = get_ElementMakerForVersion(VERSION)
 xpath_ns = get_xpath_ns(VERSION)
 
+# XPath expressions used for every execute response, compiled once
+_xpath_outputs = etree.XPath("/wps:ExecuteResponse/wps:ProcessOutputs/wps:Output", namespaces=namespaces100)
+_xpath_identifier = etree.XPath("./ows:Identifier", namespaces=namespaces100)
+_xpath_literal_data = etree.XPath("./wps:Data/wps:LiteralData", namespaces=namespaces100)
+_xpath_reference = etree.XPath("./wps:Reference", namespaces=namespaces100)
+_xpath_complex_data = etree.XPath("./wps:Data/wps:ComplexData", namespaces=namespaces100)
+
+METALINK_FILE_TAG = "{urn:ietf:params:xml:ns:metalink}file"
+METALINK_METAURL_TAG = "{urn:ietf:params:xml:ns:metalink}metaurl"
+
 TESTS_HOME = Path(__file__).parent
 CFG_FILE = str(TESTS_HOME / "test.cfg")
 
 
 class WpsTestClient(WpsClient):
-    def get(self, *args, **kwargs):
-        query = "?"
-        for key, value in kwargs.items():
-            query += "{0}={1}&".format(key, value)
-        return super(WpsTestClient, self).get(query)
+    def get(self, **kwargs):
+        return super(WpsTestClient, self).get("?" + urlencode(kwargs))
 
 
 def client_for(service):
@@ -27,20 +36,18 @@ def get_output(doc):
     """Copied from pywps/tests/test_execute.py.
     TODO: make this helper method public in pywps."""
     output = {}
-    for output_el in xpath_ns(
-        doc, "/wps:ExecuteResponse" "/wps:ProcessOutputs/wps:Output"
-    ):
-        [identifier_el] = xpath_ns(output_el, "./ows:Identifier")
+    for output_el in _xpath_outputs(doc):
+        [identifier_el] = _xpath_identifier(output_el)
 
-        lit_el = xpath_ns(output_el, "./wps:Data/wps:LiteralData")
+        lit_el = _xpath_literal_data(output_el)
         if lit_el:
             output[identifier_el.text] = lit_el[0].text
 
-        ref_el = xpath_ns(output_el, "./wps:Reference")
+        ref_el = _xpath_reference(output_el)
         if ref_el:
             output[identifier_el.text] = ref_el[0].attrib["href"]
 
-        data_el = xpath_ns(output_el, "./wps:Data/wps:ComplexData")
+        data_el = _xpath_complex_data(output_el)
         if data_el:
             output[identifier_el.text] = data_el[0].text
 
@@ -56,9 +63,8 @@ def get_metalinks(doc):
       Metalink XML etree.
     """
     output = {}
-    for child in doc.iterchildren():
-        if child.tag == "{urn:ietf:params:xml:ns:metalink}file":
-            url = child.find("{urn:ietf:params:xml:ns:metalink}metaurl")
-            output[child.attrib["name"]] = url.text
+    for child in doc.iterchildren(METALINK_FILE_TAG):
+        url = child.find(METALINK_METAURL_TAG)
+        output[child.attrib["name"]] = url.text
 
     return output
@@ -43,7 +43,7 @@ def _create_test_dataset(
       If True, add a NaN on Jan 15.
     """
 
-    rs = np.random.RandomState(seed)
+    rs = np.random.default_rng(seed)
     _vars = {variable: ["time", "lon", "lat"]}
     _dims = {"time": 365, "lon": 5, "lat": 6}
     _attrs = {
@@ -71,7 +71,7 @@ def _create_test_dataset(
     obj["lat"] = ("lat", np.arange(_dims["lat"]), {'standard_name': 'latitude'})
 
     for v, dims in sorted(_vars.items()):
-        data = rs.normal(size=tuple(_dims[d] for d in dims))
+        data = rs.standard_normal(size=tuple(_dims[d] for d in dims), dtype=np.float32)
         if missing:
             data[14, :, :] = np.nan
         obj[v] = (dims, data, {"foo": "variable"})
@@ -88,7 +88,15 @@ def _create_and_write_dataset(variable, **kwds) -> Path:
 
 def _write_dataset(variable, ds) -> Path:
     _, filename = tempfile.mkstemp(f"finch_test_data_{variable}.nc", dir=TEMP_DIR)
-    ds.to_netcdf(filename)
+    if isinstance(ds, xr.DataArray):
+        ds = ds.to_dataset()
+    # A single compressed chunk per variable, the test datasets are small
+    encoding = {
+        v: {"chunksizes": ds[v].shape, "zlib": True, "complevel": 1}
+        for v in ds.data_vars
+        if ds[v].ndim
+    }
+    ds.to_netcdf(filename, engine="h5netcdf", encoding=encoding)
     return Path(filename)
 
 
@@ -163,7 +171,8 @@ def netcdf_datasets(request) -> Dict[str, Path]:
 def netcdf_sdba_ds(request) -> Dict[str, Path]:
     """Return datasets useful to test sdba."""
     out = {}
-    u = np.random.rand(10000)
+    # seeded, so that the datasets are the same for every test session
+    u = np.random.default_rng(1).random(10000)
 
     # Define distributions
     xd = uniform(loc=10, scale=1)
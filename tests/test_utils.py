@@ -1,4 +1,5 @@
 from finch.processes.constants import ALL_24_MODELS, PCIC_12
+import logging
 from pathlib import Path
 import shutil
 from unittest import mock
@@ -8,6 +9,7 @@ import numpy as np
 import pandas as pd
 import pytest
 from pywps import configuration
+from requests.exceptions import ConnectionError
 import xarray as xr
 
 from finch.processes import ensemble_utils
@@ -16,34 +18,43 @@ from finch.processes.ensemble_utils import (
     get_bccaqv2_local_files_datasets,
 )
 from finch.processes.utils import (
+    check_opendap_urls,
+    chunk_dataset,
+    close_log_file,
+    dataset_to_dataframe,
+    dataset_to_netcdf,
     drs_filename,
+    encoded_chunks,
     is_opendap_url,
+    log_file_path,
     netcdf_file_list_to_csv,
+    write_log,
     zip_files,
 )
 
 test_data = Path(__file__).parent / "data"
 
 
-@mock.patch("finch.processes.ensemble_utils.Path")
-def test_get_local_datasets_bccaqv2(mock_path):
+def test_get_local_datasets_bccaqv2():
     names = [
-        "/mock_path/tasmin_day_BCCAQv2+ANUSPLIN300_CNRM-CM5_historical+rcp85_r1i1p1_19500101-21001231.nc",
-        "/mock_path/tasmin_day_BCCAQv2+ANUSPLIN300_CNRM-CM5_historical+rcp45_r1i1p1_19500101-21001231.nc",
-        "/mock_path/tasmin_day_BCCAQv2+ANUSPLIN300_CanESM2_historical+rcp45_r1i1p1_19500101-21001231.nc",
-        "/mock_path/tasmax_day_BCCAQv2+ANUSPLIN300_CanESM2_historical+rcp45_r1i1p1_19500101-21001231.nc",
-        "/mock_path/tasmax_day_BCCAQv2+ANUSPLIN300_NorESM1-M_historical+rcp26_r1i1p1_19500101-21001231.nc",
-        "/mock_path/tasmax_day_BCCAQv2+ANUSPLIN300_NorESM1-ME_historical+rcp85_r1i1p1_19500101-21001231.nc",
-        "/mock_path/tasmax_day_BCCAQv2+ANUSPLIN300_NorESM1-ME_historical+rcp45_r1i1p1_19500101-21001231.nc",
+        "tasmin_day_BCCAQv2+ANUSPLIN300_CNRM-CM5_historical+rcp85_r1i1p1_19500101-21001231.nc",
+        "tasmin_day_BCCAQv2+ANUSPLIN300_CNRM-CM5_historical+rcp45_r1i1p1_19500101-21001231.nc",
+        "tasmin_day_BCCAQv2+ANUSPLIN300_CanESM2_historical+rcp45_r1i1p1_19500101-21001231.nc",
+        "tasmax_day_BCCAQv2+ANUSPLIN300_CanESM2_historical+rcp45_r1i1p1_19500101-21001231.nc",
+        "tasmax_day_BCCAQv2+ANUSPLIN300_NorESM1-M_historical+rcp26_r1i1p1_19500101-21001231.nc",
+        "tasmax_day_BCCAQv2+ANUSPLIN300_NorESM1-ME_historical+rcp85_r1i1p1_19500101-21001231.nc",
+        "tasmax_day_BCCAQv2+ANUSPLIN300_NorESM1-ME_historical+rcp45_r1i1p1_19500101-21001231.nc",
+        "tasmin_day_BCCAQv2+ANUSPLIN300_CanESM2_historical+rcp45_r1i1p1_19500101-21001231.nc.md5",
     ]
-    catalog_url = "/mock_path"
+    catalog = Path(__file__).parent / "tmp" / "local_bccaqv2"
+    shutil.rmtree(catalog, ignore_errors=True)
+    catalog.mkdir(parents=True)
+    for name in names:
+        (catalog / name).touch()
+    catalog_url = str(catalog)
     variable = "tasmin"
     rcp = "rcp45"
 
-    mock_path_instance = mock.MagicMock()
-    mock_path.return_value = mock_path_instance
-    mock_path_instance.glob.return_value = [Path(n) for n in names]
-
     files = get_bccaqv2_local_files_datasets(catalog_url, [variable], rcp)
     assert len(files) == 2
 
@@ -124,6 +135,79 @@ def test_netcdf_file_list_to_csv_to_zip():
                 assert False, "Unknown calendar type"
 
 
+def test_zip_files_log_function():
+    output_folder = Path(__file__).parent / "tmp" / "zip_files_log"
+    shutil.rmtree(output_folder, ignore_errors=True)
+    output_folder.mkdir(parents=True)
+
+    files = []
+    for n in range(250):
+        files.append(output_folder / f"{n}.csv")
+        files[-1].write_text("time,tas\n")
+
+    log_function = mock.MagicMock()
+    zip_files(output_folder / "output.zip", files, log_function=log_function)
+
+    percentages = [c.args[1] for c in log_function.call_args_list]
+    assert percentages == list(range(100))
+
+
+@pytest.mark.parametrize("calendar", ["standard", "noleap"])
+def test_dataset_to_dataframe_hour(calendar):
+    time = xr.cftime_range("1969-12-30 00:30", periods=4, freq="D", calendar=calendar)
+    if calendar == "standard":
+        time = time.to_datetimeindex()
+    ds = xr.Dataset({"tas": ("time", np.arange(4.0))}, coords={"time": time})
+    ds.time.attrs["axis"] = "T"
+
+    df = dataset_to_dataframe(ds)
+
+    assert [t.hour for t in df.index] == [12] * 4
+    assert [t.minute for t in df.index] == [30] * 4
+    assert [t.day for t in df.index] == [30, 31, 1, 2]
+    assert ds.time.attrs["axis"] == "T"
+
+
+def test_write_log():
+    workdir = Path(__file__).parent / "tmp" / "write_log"
+    shutil.rmtree(workdir, ignore_errors=True)
+    workdir.mkdir(parents=True)
+
+    process = mock.MagicMock(workdir=str(workdir), status_percentage_steps={})
+    process.response.status_percentage = 0
+
+    write_log(process, "first")
+    write_log(process, "second")
+    write_log(process, "debug", level=logging.DEBUG)
+    # lines are available before the file is closed
+    assert log_file_path(process).read_text() == "first\nsecond\n"
+
+    close_log_file(process)
+    write_log(process, "third")
+    close_log_file(process)
+    assert log_file_path(process).read_text() == "first\nsecond\nthird\n"
+
+
+def test_zip_files_netcdf_stored():
+    output_folder = Path(__file__).parent / "tmp" / "zip_files"
+    shutil.rmtree(output_folder, ignore_errors=True)
+    output_folder.mkdir(parents=True)
+
+    netcdf_file = test_data / "cordex_subset.nc"
+    csv_file = output_folder / "data.csv"
+    csv_file.write_text("time,tas\n" * 100)
+
+    output_zip = output_folder / "output.zip"
+    zip_files(output_zip, [netcdf_file, csv_file])
+
+    with zipfile.ZipFile(output_zip) as z:
+        infos = {Path(i.filename).name: i for i in z.infolist()}
+        assert infos["cordex_subset.nc"].compress_type == zipfile.ZIP_STORED
+        assert infos["data.csv"].compress_type == zipfile.ZIP_DEFLATED
+        assert infos["data.csv"].compress_size < infos["data.csv"].file_size / 10
+        assert z.read(infos["cordex_subset.nc"]) == netcdf_file.read_bytes()
+
+
 def test_netcdf_file_list_to_csv_bad_hours():
     here = Path(__file__).parent
     folder = here / "data" / "bccaqv2_single_cell"
@@ -151,6 +235,36 @@ def test_netcdf_file_list_to_csv_bad_hours():
         assert np.all(df.time.dt.hour == 12)
 
 
+@mock.patch("finch.processes.utils._http_session.head")
+def test_is_opendap_url_cached(mock_head):
+    url = "https://example.com/thredds/dodsC/cached.nc"
+    mock_head.return_value.headers = {"Content-Description": "dods-dds"}
+
+    check_opendap_urls([url, "https://example.com/thredds/fileServer/cached.nc"])
+    assert mock_head.call_count == 2
+    assert is_opendap_url(url)
+    assert mock_head.call_count == 2
+
+    mock_head.side_effect = ConnectionError
+    failed_url = "https://example.com/thredds/dodsC/failed.nc"
+    assert not is_opendap_url(failed_url)
+    assert not is_opendap_url(failed_url)
+    assert mock_head.call_count == 4
+
+
+@mock.patch("finch.processes.utils._http_session.head")
+def test_is_opendap_url_error_response_not_cached(mock_head):
+    url = "https://example.com/thredds/dodsC/unavailable.nc"
+    mock_head.return_value.ok = False  # ex: 503 Service Unavailable
+    mock_head.return_value.headers = {}
+    assert not is_opendap_url(url)
+
+    mock_head.return_value.ok = True
+    mock_head.return_value.headers = {"Content-Description": "dods-dds"}
+    assert is_opendap_url(url)
+    assert mock_head.call_count == 2
+
+
 @pytest.mark.online
 def test_is_opendap_url():
     # This test uses online requests, and the servers are not as stable as hoped.
@@ -179,6 +293,94 @@ def test_is_opendap_url():
     assert not is_opendap_url(url)
 
 
+def test_chunk_dataset():
+    ds = xr.Dataset(coords={"time": range(54750), "lat": range(10), "lon": range(10)})
+
+    chunks = chunk_dataset(ds, max_size=1000000)
+    assert np.prod(list(chunks.values())) < 1000000
+    assert chunks["time"] < 54750
+
+    chunks = chunk_dataset(ds, max_size=1000000, chunk_dims=["lat", "lon"])
+    assert chunks["time"] == 54750
+    assert np.prod(list(chunks.values())) < 1000000
+
+    chunks = chunk_dataset(ds, max_size=1000000, chunk_dims=["region"])
+    assert chunks == dict(ds.sizes)
+
+
+def _disk_layout_dataset(shape, chunksizes):
+    data = np.broadcast_to(np.float32(0), shape)
+    ds = xr.Dataset({"tas": (("time", "lat", "lon"), data)})
+    ds.tas.encoding["chunksizes"] = chunksizes
+    return ds
+
+
+def test_encoded_chunks():
+    # tasmin is stored in chunks of (time=1, rlat=2, rlon=3)
+    ds = xr.open_dataset(test_data / "cordex_subset.nc")
+
+    chunks = encoded_chunks(ds, max_size=60)
+    assert chunks == {"rlon": 1, "rlat": 1, "height": 1, "time": 50, "bnds": 1}
+
+    chunks = encoded_chunks(ds, chunk_dims=["rlat", "rlon"])
+    assert chunks == dict(ds.sizes)
+
+    ds = xr.open_dataset(test_data / "bccaqv2_subset_sample/tasmax_bcc-csm1-1_subset.nc")
+    assert encoded_chunks(ds) == {}
+
+
+@pytest.mark.parametrize(
+    "shape,chunksizes",
+    [
+        # the whole variable is a single chunk on disk
+        ((20000, 20, 20), (20000, 20, 20)),
+        # one record per time step
+        ((20000, 51, 107), (1, 51, 107)),
+        # chunked along every dimension
+        ((20000, 51, 107), (100, 10, 10)),
+    ],
+)
+def test_encoded_chunks_layouts(shape, chunksizes):
+    ds = _disk_layout_dataset(shape, chunksizes)
+
+    chunks = encoded_chunks(ds, max_size=1000000)
+
+    assert np.prod(list(chunks.values())) < 1000000
+    for dim, size, disk_chunk in zip(ds.tas.dims, shape, chunksizes):
+        # dask chunks can only overlap two chunks on disk if there are several along the dimension
+        chunk = chunks[dim]
+        assert disk_chunk >= size or chunk % disk_chunk == 0 or disk_chunk % chunk == 0
+    # not much smaller than the chunks that don't take the layout into account
+    expected = chunk_dataset(ds, max_size=1000000)
+    assert chunks["time"] == expected["time"]
+    assert np.prod(list(chunks.values())) > np.prod(list(expected.values())) / 10
+
+
+def test_dataset_to_netcdf_compression():
+    output_folder = Path(__file__).parent / "tmp" / "dataset_to_netcdf"
+    output_folder.mkdir(parents=True, exist_ok=True)
+    ds = xr.open_dataset(test_data / "cordex_subset.nc")
+
+    dataset_to_netcdf(ds, output_folder / "compressed.nc")
+    dataset_to_netcdf(ds, output_folder / "uncompressed.nc", compression_level=0)
+
+    compressed = xr.open_dataset(output_folder / "compressed.nc")
+    encoding = compressed.tasmin.encoding
+    assert encoding["zlib"] and encoding["shuffle"] and encoding["complevel"] == 1
+    assert encoding["chunksizes"] == compressed.tasmin.shape
+    xr.testing.assert_identical(compressed.tasmin, ds.tasmin)
+
+    uncompressed = xr.open_dataset(output_folder / "uncompressed.nc")
+    assert not uncompressed.tasmin.encoding["zlib"]
+
+    # dask arrays are stored in chunks matching their dask chunks
+    chunked = ds.chunk({"time": 30})
+    dataset_to_netcdf(chunked, output_folder / "compressed_dask.nc")
+    compressed = xr.open_dataset(output_folder / "compressed_dask.nc")
+    assert compressed.tasmin.encoding["chunksizes"] == (30, 2, 3)
+    xr.testing.assert_identical(compressed.tasmin, ds.tasmin)
+
+
 def test_bccaqv2_make_file_groups():
     folder = Path(__file__).parent / "data" / "bccaqv2_single_cell"
     files_list = list(folder.glob("*.nc"))
@@ -237,6 +439,14 @@ def test_bccaqv2file():
     )
     assert expected == file
 
+    # the fields can contain underscores, and the matching is case insensitive
+    file = ensemble_utils.Bccaqv2File.from_filename(filename.replace(".nc", "_sub.nc"))
+    assert file.date_end == "21001231_sub"
+    file = ensemble_utils.Bccaqv2File.from_filename(filename.replace("BCCAQv2", "bccaqv2"))
+    assert file == expected
+
+    assert ensemble_utils.Bccaqv2File.from_filename(filename + ".md5") is None
+
 
 @pytest.mark.parametrize(
     "filename,variable,rcp,models,expected",
@@ -4,10 +4,15 @@ import zipfile
 
 import numpy as np
 import geojson
+import xarray as xr
 from xarray import open_dataset
+from xclim.core.calendar import percentile_doy
 import pytest
+import xclim
 
 from finch.processes import ensemble_utils
+from finch.processes.wps_base import make_xclim_indicator_process
+from finch.processes.wps_ensemble_indices_point import XclimEnsembleGridPointBase
 from finch.processes.constants import PCIC_12
 from tests.utils import execute_process, mock_local_datasets, wps_literal_input
 
@@ -92,6 +97,7 @@ def test_ensemble_dded_grid_point_multircp(mock_datasets, client):
 
     # --- then ---
     assert len(outputs) == 1
+    assert str(outputs[0]).endswith("_rcp26_rcp45_ensemble.nc")
     ds = open_dataset(outputs[0])
     dims = dict(ds.dims)
     assert dims == {
@@ -331,6 +337,83 @@ def test_compute_intermediate_variables(monkeypatch):
     assert sorted(files_outputs) == sorted(expected)
 
 
+def test_ensemble_process_inputs_cached():
+    indicator = xclim.atmos.tg_mean
+    process = make_xclim_indicator_process(indicator, "_Ensemble_GridPoint", XclimEnsembleGridPointBase)
+    other = type(process)()
+
+    assert [i.identifier for i in process.inputs] == [i.identifier for i in other.inputs]
+    # the cached inputs are copied for each instance
+    _, cached_inputs = type(process).__dict__["_xci_cache"]
+    cached_ids = set(map(id, cached_inputs))
+    assert not cached_ids & set(map(id, process.inputs))
+    assert not cached_ids & set(map(id, other.inputs))
+
+
+def test_concat_rcps():
+    subset_folder = Path(__file__).parent / "data" / "bccaqv2_subset_sample"
+    ds = open_dataset(subset_folder / "tasmin_inmcm4_subset.nc").load()
+    ensembles = [ds, ds + 1]
+    rcps = ["rcp26", "rcp45"]
+
+    concatenated = ensemble_utils.concat_rcps(ensembles, rcps)
+    expected = xr.concat(ensembles, dim=xr.DataArray(rcps, dims=("rcp",), name="rcp"))
+    xr.testing.assert_identical(concatenated, expected)
+
+    # mismatched coordinates are concatenated with xarray
+    shifted = ds.isel(time=slice(1, None))
+    concatenated = ensemble_utils.concat_rcps([ds, shifted], rcps)
+    assert concatenated.time.size == ds.time.size
+
+
+def test_tas_misaligned_inputs():
+    subset_folder = Path(__file__).parent / "data" / "bccaqv2_subset_sample"
+    tasmin = open_dataset(subset_folder / "tasmin_inmcm4_subset.nc")
+    tasmax = open_dataset(subset_folder / "tasmax_inmcm4_subset.nc").isel(time=slice(1, None))
+
+    tas = ensemble_utils._tas(tasmin, tasmax)
+
+    expected = (tasmin.tasmin + tasmax.tasmax) / 2
+    assert tas.time.size == tasmin.time.size - 1
+    np.testing.assert_allclose(tas.tas, expected, rtol=1e-6)
+
+
+def test_get_sub_inputs():
+    assert sorted(ensemble_utils.get_sub_inputs(["pr"])) == ["pr"]
+    assert sorted(ensemble_utils.get_sub_inputs(["tas", "tasmax"])) == ["tasmax", "tasmin"]
+    assert sorted(ensemble_utils.get_sub_inputs(["tn10", "tx90"])) == ["tasmax", "tasmin"]
+    assert sorted(ensemble_utils.get_sub_inputs(["t10", "pr"])) == ["pr", "tasmax", "tasmin"]
+
+
+def test_compute_intermediate_variables_percentiles(monkeypatch):
+    # --- given ---
+    workdir = Path(__file__).parent / "tmp" / "temp_compute_intermediate_percentiles"
+    workdir.mkdir(parents=True, exist_ok=True)
+    subset_folder = Path(__file__).parent / "data" / "bccaqv2_subset_sample"
+    mock_paths = [subset_folder / p for p in mock_filenames]
+
+    required_variables = ["tn10", "tn90"]
+
+    # --- when ---
+    files_outputs = ensemble_utils.compute_intermediate_variables(
+        mock_paths, required_variables, workdir
+    )
+
+    # --- then ---
+    expected = [workdir / f"tn10+tn90_{d}" for d in ["bcc-csm1-1_subset.nc", "inmcm4_subset.nc"]]
+    assert sorted(files_outputs) == sorted(expected)
+
+    groups = ensemble_utils.make_file_groups(files_outputs)
+    assert all(set(g) == {"tn10", "tn90"} for g in groups)
+
+    tasmin = open_dataset(subset_folder / "tasmin_inmcm4_subset.nc").tasmin
+    computed_ds = open_dataset(workdir / "tn10+tn90_inmcm4_subset.nc")
+    for variable, per in [("tn10", 10), ("tn90", 90)]:
+        computed = computed_ds[variable]
+        expected = percentile_doy(tasmin, per=per).sel(percentiles=per, drop=True)
+        np.testing.assert_allclose(computed, expected, rtol=1e-6)
+
+
 def test_ensemble_compute_intermediate_cold_spell_duration_index_grid_point(
     mock_datasets, client
 ):